@@ -0,0 +1,11 @@
+"""pytest configuration."""
+
+
+collect_ignore = []
+
+# The numba callbacks can only be imported, including for their doctests,
+# with numba installed
+try:
+    import numba
+except ImportError:
+    collect_ignore.append('mseipopt/njit_callbacks.py')
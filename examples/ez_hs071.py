@@ -34,15 +34,12 @@ def jac_ind():
             [0, 1, 2, 3, 0, 1, 2, 3])
 
 
-def jac_val(x):
-    return [x[1]*x[2]*x[3], 
-            x[0]*x[2]*x[3], 
-            x[0]*x[1]*x[3], 
-            x[0]*x[1]*x[2],
-            2.0*x[0],
-            2.0*x[1],
-            2.0*x[2],
-            2.0*x[3]]
+def jac_val(x, out):
+    out[0] = x[1]*x[2]*x[3]
+    out[1] = x[0]*x[2]*x[3]
+    out[2] = x[0]*x[1]*x[3]
+    out[3] = x[0]*x[1]*x[2]
+    out[4:] = 2.0*x
 
 
 def hess_ind():
@@ -50,17 +47,23 @@ def hess_ind():
             [0, 0, 1, 0, 1, 2, 0, 1, 2, 3])
 
 
-def hess_val(x, obj_factor, mult):
-    return [obj_factor*2*x[3] + mult[1]*2,
-            obj_factor*x[3] + mult[0]*(x[2]*x[3]),
-            mult[1]*2,
-            obj_factor*(x[3]) + mult[0]*(x[1]*x[3]),
-            mult[0]*(x[0]*x[3]),
-            mult[1]*2,
-            obj_factor*(2*x[0] + x[1] + x[2]) +  mult[0]*x[1]*x[2],
-            obj_factor*x[0] + mult[0]*x[0]*x[2],
-            obj_factor*x[0] + mult[0]*x[0]*x[1],
-            mult[1]*2]
+def hess_val(x, obj_factor, mult, out):
+    x0, x1, x2, x3 = x
+    mult0, mult1 = mult
+    mult1_2 = mult1*2
+    obj_x0 = obj_factor*x0
+    obj_x3 = obj_factor*x3
+    mult0_x3 = mult0*x3
+    out[:] = (obj_x3*2 + mult1_2,
+              obj_x3 + mult0_x3*x2,
+              mult1_2,
+              obj_x3 + mult0_x3*x1,
+              mult0_x3*x0,
+              mult1_2,
+              obj_factor*(2*x0 + x1 + x2) + mult0*x1*x2,
+              obj_x0 + mult0*x0*x2,
+              obj_x0 + mult0*x0*x1,
+              mult1_2)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,155 @@
+# cython: language_level=3
+"""Compiled trampolines for the IPOPT callbacks of `bare_np`.
+
+This optional extension replaces the ctypes trampolines of `bare_np` by c
+functions, which wrap the IPOPT buffers in ndarrays and call the user python
+functions. The functions are taken from a `Trampolines` object, which must be
+passed as the IPOPT `user_data`. The trampolines are called by IPOPT without
+the GIL, which is only acquired to call the python functions.
+"""
+
+
+cimport numpy as cnp
+
+cnp.import_array()
+
+
+cdef class Trampolines:
+    """Python functions called by the trampolines of a problem."""
+
+    cdef object handler
+    cdef object f
+    cdef object grad_f
+    cdef object g
+    cdef object jac_g
+    cdef object h
+
+    def __init__(self, handler):
+        self.handler = handler if callable(handler) else None
+
+    def set_f(self, f):
+        """Use `f` as objective function, return the trampoline address."""
+        self.f = f
+        return <size_t> &eval_f_trampoline
+
+    def set_grad_f(self, grad_f):
+        """Use `grad_f` as objective gradient, return trampoline address."""
+        self.grad_f = grad_f
+        return <size_t> &eval_grad_f_trampoline
+
+    def set_g(self, g):
+        """Use `g` as constraint function, return the trampoline address."""
+        self.g = g
+        return <size_t> &eval_g_trampoline
+
+    def set_jac_g(self, jac_g):
+        """Use `jac_g` as constraint Jacobian, return trampoline address."""
+        self.jac_g = jac_g
+        return <size_t> &eval_jac_g_trampoline
+
+    def set_h(self, h):
+        """Use `h` as Lagrangian Hessian, return the trampoline address."""
+        self.h = h
+        return <size_t> &eval_h_trampoline
+
+
+cdef int handle(Trampolines trampolines, BaseException e):
+    if trampolines.handler is not None:
+        trampolines.handler(e)
+    return 0
+
+
+cdef inline object double_array(int size, double *data):
+    cdef cnp.npy_intp shape = size
+    return cnp.PyArray_SimpleNewFromData(1, &shape, cnp.NPY_DOUBLE, data)
+
+
+cdef inline object int_array(int size, int *data):
+    cdef cnp.npy_intp shape = size
+    return cnp.PyArray_SimpleNewFromData(1, &shape, cnp.NPY_INT, data)
+
+
+cdef int eval_f_trampoline(int n, double *x, int new_x, double *obj_value,
+                           void *user_data) noexcept nogil:
+    with gil:
+        trampolines = <Trampolines> user_data
+        try:
+            obj_value_array = cnp.PyArray_SimpleNewFromData(
+                0, NULL, cnp.NPY_DOUBLE, obj_value
+            )
+            return trampolines.f(double_array(n, x), new_x, obj_value_array)
+        except BaseException as e:
+            return handle(trampolines, e)
+
+
+cdef int eval_grad_f_trampoline(int n, double *x, int new_x, double *grad_f,
+                                void *user_data) noexcept nogil:
+    with gil:
+        trampolines = <Trampolines> user_data
+        try:
+            x_array = double_array(n, x)
+            return trampolines.grad_f(x_array, new_x, double_array(n, grad_f))
+        except BaseException as e:
+            return handle(trampolines, e)
+
+
+cdef int eval_g_trampoline(int n, double *x, int new_x, int m, double *g,
+                           void *user_data) noexcept nogil:
+    with gil:
+        trampolines = <Trampolines> user_data
+        try:
+            x_array = double_array(n, x)
+            return trampolines.g(x_array, new_x, double_array(m, g))
+        except BaseException as e:
+            return handle(trampolines, e)
+
+
+cdef int eval_jac_g_trampoline(int n, double *x, int new_x, int m,
+                               int nele_jac, int *iRow, int *jCol,
+                               double *values, void *user_data) noexcept nogil:
+    # Values are requested with NULL indices and vice versa
+    if values != NULL:
+        with gil:
+            trampolines = <Trampolines> user_data
+            try:
+                x_array = double_array(n, x)
+                values_array = double_array(nele_jac, values)
+                return trampolines.jac_g(x_array, new_x, None, None,
+                                         values_array)
+            except BaseException as e:
+                return handle(trampolines, e)
+    with gil:
+        trampolines = <Trampolines> user_data
+        try:
+            i_array = int_array(nele_jac, iRow)
+            j_array = int_array(nele_jac, jCol)
+            return trampolines.jac_g(None, new_x, i_array, j_array, None)
+        except BaseException as e:
+            return handle(trampolines, e)
+
+
+cdef int eval_h_trampoline(int n, double *x, int new_x, double obj_factor,
+                           int m, double *mult, int new_mult, int nele_hess,
+                           int *iRow, int *jCol, double *values,
+                           void *user_data) noexcept nogil:
+    # Values are requested with NULL indices and vice versa
+    if values != NULL:
+        with gil:
+            trampolines = <Trampolines> user_data
+            try:
+                x_array = double_array(n, x)
+                mult_array = double_array(m, mult) if mult != NULL else None
+                values_array = double_array(nele_hess, values)
+                return trampolines.h(x_array, new_x, obj_factor, mult_array,
+                                     new_mult, None, None, values_array)
+            except BaseException as e:
+                return handle(trampolines, e)
+    with gil:
+        trampolines = <Trampolines> user_data
+        try:
+            i_array = int_array(nele_hess, iRow)
+            j_array = int_array(nele_hess, jCol)
+            return trampolines.h(None, new_x, obj_factor, None, new_mult,
+                                 i_array, j_array, None)
+        except BaseException as e:
+            return handle(trampolines, e)
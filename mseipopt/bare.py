@@ -13,6 +13,14 @@ is called, an attempt is made to find load the library.
 After a problem is no longer needed, `FreeIpoptProblem` should be called, or 
 memory will leak. If `FreeIpoptProblem` is called more than once on the same
 problem, the program will likely crash.
+
+Once the library is loaded, the module-level wrappers of the library functions
+are replaced by the ctypes functions themselves, so that calls from then on do
+not go through any python code.
+
+The library is loaded as a `ctypes.CDLL`, so the GIL is released while its
+functions run, in particular during `IpoptSolve`. The ctypes callbacks take
+it back to run the python code, while compiled callbacks run without it.
 """
 
 
@@ -33,6 +41,8 @@ c_int_p = POINTER(c_int)
 """Pointer to int."""
 
 
+# The callback types keep the CFUNCTYPE defaults use_errno=False and
+# use_last_error=False, so ctypes does not swap errno around the callbacks.
 Eval_F_CB = CFUNCTYPE(c_int, c_int, c_double_p, c_int, 
                       c_double_p, c_void_p)
 """Type of the callback for evaluating the objective function."""
@@ -80,6 +90,24 @@ IpoptProblem = POINTER(IpoptProblemInfo)
 """Pointer to a IPOPT problem."""
 
 
+class _AsciiStr(c_char_p):
+    """String argument type which also accepts `str`, encoded as ASCII."""
+
+    @classmethod
+    def from_param(cls, obj):
+        if isinstance(obj, str):
+            return obj.encode('ascii')
+        return super().from_param(obj)
+
+
+_direct_functions = (
+    'CreateIpoptProblem', 'FreeIpoptProblem', 'AddIpoptStrOption',
+    'AddIpoptNumOption', 'AddIpoptIntOption', 'OpenIpoptOutputFile',
+    'SetIpoptProblemScaling', 'SetIntermediateCallback', 'IpoptSolve',
+)
+"""Wrappers replaced by the library functions after it is loaded."""
+
+
 def default_ipopt_library_name():
     if os.name == 'nt':
         return "ipopt"
@@ -109,30 +137,37 @@ def _setup_library():
     _ipopt_lib.FreeIpoptProblem.argtypes = [IpoptProblem]
 
     _ipopt_lib.AddIpoptStrOption.restype = c_int
-    _ipopt_lib.AddIpoptStrOption.argtypes = [IpoptProblem, c_char_p, c_char_p]
+    _ipopt_lib.AddIpoptStrOption.argtypes = [
+        IpoptProblem, _AsciiStr, _AsciiStr
+    ]
 
     _ipopt_lib.AddIpoptIntOption.restype = c_int
-    _ipopt_lib.AddIpoptIntOption.argtypes = [IpoptProblem, c_char_p, c_int]
+    _ipopt_lib.AddIpoptIntOption.argtypes = [IpoptProblem, _AsciiStr, c_int]
 
     _ipopt_lib.AddIpoptNumOption.restype = c_int
-    _ipopt_lib.AddIpoptNumOption.argtypes = [IpoptProblem, c_char_p, c_double]
+    _ipopt_lib.AddIpoptNumOption.argtypes = [IpoptProblem, _AsciiStr, c_double]
 
-    _ipopt_lib.OpenIpoptOutputFile.restypes = c_int
-    _ipopt_lib.OpenIpoptOutputFile.argtypes = [IpoptProblem, c_char_p, c_int]
+    _ipopt_lib.OpenIpoptOutputFile.restype = c_int
+    _ipopt_lib.OpenIpoptOutputFile.argtypes = [IpoptProblem, _AsciiStr, c_int]
 
-    _ipopt_lib.SetIpoptProblemScaling.restypes = c_int
+    _ipopt_lib.SetIpoptProblemScaling.restype = c_int
     _ipopt_lib.SetIpoptProblemScaling.argtypes = [IpoptProblem, c_double, 
                                                   c_double_p, c_double_p]
     
-    _ipopt_lib.SetIntermediateCallback.restypes = c_int
+    _ipopt_lib.SetIntermediateCallback.restype = c_int
     _ipopt_lib.SetIntermediateCallback.argtypes = [IpoptProblem,Intermediate_CB]
     
-    _ipopt_lib.IpoptSolve.restypes = c_int
+    _ipopt_lib.IpoptSolve.restype = c_int
     _ipopt_lib.IpoptSolve.argtypes = [
         IpoptProblem, c_double_p, c_double_p, c_double_p, c_double_p, 
         c_double_p, c_double_p, c_void_p
     ]
 
+    # Skip the python wrappers from now on
+    module = globals()
+    for name in _direct_functions:
+        module[name] = getattr(_ipopt_lib, name)
+
 
 def default_setup():
     if _ipopt_lib is None:
@@ -143,7 +178,8 @@ def CreateIpoptProblem(n, x_L, x_U, m, g_L, g_U, nele_jac, nele_hess,
                        index_style, eval_f, eval_g, eval_grad_f, eval_jac_g,
                        eval_h):
     """Create a new IPOPT Problem object."""
-    default_setup()
+    if _ipopt_lib is None:
+        load_library()
     return _ipopt_lib.CreateIpoptProblem(
         n, x_L, x_U, m, g_L, g_U, nele_jac, nele_hess, index_style,
         eval_f, eval_g, eval_grad_f, eval_jac_g, eval_h
@@ -157,24 +193,20 @@ def FreeIpoptProblem(ipopt_problem):
 
 def AddIpoptStrOption(problem, keyword, val):
     assert _ipopt_lib is not None, "library must be loaded to create problem"
-    if isinstance(keyword, str):
-        keyword = keyword.encode('ascii')
-    if isinstance(val, str):
-        val = val.encode('ascii')
+    keyword = keyword.encode('ascii') if isinstance(keyword, str) else keyword
+    val = val.encode('ascii') if isinstance(val, str) else val
     return _ipopt_lib.AddIpoptStrOption(problem, keyword, val)
 
 
 def AddIpoptNumOption(problem, keyword, val):
     assert _ipopt_lib is not None, "library must be loaded to create problem"
-    if isinstance(keyword, str):
-        keyword = keyword.encode('ascii')
+    keyword = keyword.encode('ascii') if isinstance(keyword, str) else keyword
     return _ipopt_lib.AddIpoptNumOption(problem, keyword, val)
 
 
 def AddIpoptIntOption(problem, keyword, val):
     assert _ipopt_lib is not None, "library must be loaded to create problem"
-    if isinstance(keyword, str):
-        keyword = keyword.encode('ascii')
+    keyword = keyword.encode('ascii') if isinstance(keyword, str) else keyword
     return _ipopt_lib.AddIpoptIntOption(problem, keyword, val)
 
 
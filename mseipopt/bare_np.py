@@ -6,48 +6,67 @@ parameters in the callbacks are converted to ndarrays and the function inputs
 are validated more thoroughly. However, the functions and callbacks map almost
 directly to the IPOPT c interface.
 
+The callbacks always catch the exceptions and signal the failure to IPOPT, as
+an exception escaping a ctypes callback leaves its return value undefined. If
+the handler is None, the exceptions are silently discarded.
+
+If the optional `_callbacks` extension module is compiled, its trampolines are
+used instead of the ctypes ones to call the python callbacks. They are called
+by IPOPT without the GIL and only acquire it to call the python function, so
+other threads can run during `Problem.solve` between the callbacks.
 """
 
 
+import ctypes
 import functools
+import math
+import numbers
+import traceback
+import weakref
 
 import numpy as np
-from numpy.ctypeslib import as_array
 
 from . import bare
 
+try:
+    from . import _callbacks
+except ImportError:
+    _callbacks = None
+
 
 def default_handler(e):
     """Exception handler for IPOPT ctypes callbacks, prints the traceback."""
-    import traceback
     traceback.print_exc()
 
 
 class Problem:
     def __init__(self, x_bounds, g_bounds, nele_jac, nele_hess, index_style,
-                 f, g, grad_f, jac_g, h=None, *, handler=default_handler):
+                 f, g, grad_f, jac_g, h=None, *, handler=default_handler,
+                 cache_callbacks=True):
         # Unpack and validate decision variable bounds
         x_L, x_U = x_bounds
-        x_L = np.require(x_L, np.double, ['A', 'C'])
-        x_U = np.require(x_U, np.double, ['A', 'C'])
+        x_L = _as_double(x_L)
+        x_U = _as_double(x_U)
         n = x_L.size
         if x_U.size != n:
             raise ValueError("Inconsistent sizes of 'x' lower and upper bounds")
         
         # Unpack and validate constraint bounds
         g_L, g_U = g_bounds
-        g_L = np.require(g_L, np.double, ['A', 'C'])
-        g_U = np.require(g_U, np.double, ['A', 'C'])
+        g_L = _as_double(g_L)
+        g_U = _as_double(g_U)
         m = g_L.size
         if g_U.size != m:
             raise ValueError("Inconsistent sizes of 'g' lower and upper bounds")
         
         # Wrap the callbacks
-        eval_f = wrap_f(f, handler)
-        eval_g = wrap_g(g, handler)
-        eval_grad_f = wrap_grad_f(grad_f, handler)
-        eval_jac_g = wrap_jac_g(jac_g, handler)
-        eval_h = wrap_h(h, handler) if h is not None else bare.Eval_H_CB()
+        trampolines = _callbacks and _callbacks.Trampolines(handler)
+        callbacks = f, g, grad_f, jac_g, h, handler
+        if cache_callbacks and trampolines is None and is_hashable(callbacks):
+            wrapped = cached_wrap_callbacks(*callbacks)
+        else:
+            wrapped = wrap_callbacks(*callbacks, trampolines)
+        eval_f, eval_g, eval_grad_f, eval_jac_g, eval_h = wrapped
         problem = bare.CreateIpoptProblem(
             n, data_ptr(x_L), data_ptr(x_U), m, data_ptr(g_L), data_ptr(g_U),
             nele_jac, nele_hess, index_style, 
@@ -60,6 +79,10 @@ class Problem:
         self._problem = problem
         """Pointer to the underlying `IpoptProblemInfo` structure."""
         
+        free = bare.FreeIpoptProblem
+        self._finalizer = weakref.finalize(self, free, problem)
+        """Frees the IPOPT problem when called or when `self` is collected."""
+        
         self.n = n
         """Number of decision variables (length of `x`)."""
         
@@ -68,9 +91,20 @@ class Problem:
 
         self._callbacks = dict(
             eval_f=eval_f, eval_g=eval_g,  eval_grad_f=eval_grad_f,
-            eval_jac_g=eval_jac_g, eval_h=eval_h
+            eval_jac_g=eval_jac_g, eval_h=eval_h,
+            user=(f, g, grad_f, jac_g, h), trampolines=trampolines
         )
         """Reference to callbacks to ensure they aren't garbage collected."""
+
+        self._user_data = trampolines and id(trampolines)
+        """IPOPT `user_data`, address of the compiled trampolines object."""
+
+        self._solve_specs = (
+            ((n,), 'x', False), ((m,), 'g', True), ((), 'obj_val', True),
+            ((m,), 'mult_g', True), ((n,), 'mult_x_L', True),
+            ((n,), 'mult_x_U', True),
+        )
+        """Shape, name and `none_ok` of each `solve` argument, to validate."""
         
         # Set options
         if h is None:
@@ -79,7 +113,7 @@ class Problem:
     def free(self):
         if not self._problem:
             raise RuntimeError('Problem invalid or already freed')
-        bare.FreeIpoptProblem(self._problem)
+        self._finalizer()
         del self._callbacks
         self._problem = None
     
@@ -95,6 +129,45 @@ class Problem:
         if not bare.AddIpoptNumOption(self._problem, keyword, val):
             raise ValueError(f'invalid option or value')
 
+    def set_options(self, options):
+        """Set options from a mapping, with the type given by the values."""
+        self.set_options_frozen(self.freeze_options(options))
+
+    def set_options_frozen(self, frozen):
+        """Set options prepared with `freeze_options`."""
+        for keyword, val, method in frozen:
+            try:
+                getattr(self, method)(keyword, val)
+            except ValueError:
+                # Integers are also valid values of numeric options
+                if method != 'add_int_option':
+                    raise
+                self.add_num_option(keyword, float(val))
+
+    @classmethod
+    def freeze_options(cls, options):
+        """Encode and classify options, for reuse with `set_options_frozen`.
+
+        String values are string options, with booleans converted to 'yes' or
+        'no', integers are integer options and everything else is a numeric
+        option. Integers are set as numbers if IPOPT rejects them as integer
+        options.
+        """
+        frozen = []
+        for keyword, val in dict(options).items():
+            if isinstance(val, bool):
+                val = 'yes' if val else 'no'
+            if isinstance(val, str):
+                method = 'add_str_option'
+                val = val.encode('ascii')
+            elif isinstance(val, numbers.Integral):
+                method = 'add_int_option'
+                val = int(val)
+            else:
+                method = 'add_num_option'
+                val = float(val)
+            frozen.append((keyword.encode('ascii'), val, method))
+        return tuple(frozen)
 
     def open_output_file(self, file_name, print_level):
         if not bare.OpenIpoptOutputFile(self._problem, file_name, print_level):
@@ -124,17 +197,15 @@ class Problem:
     
     def solve(self, x, g=None, obj_val=None, 
               mult_g=None, mult_x_L=None, mult_x_U=None):
-        exc = (validate_io_array(x, (self.n,), 'x', none_ok=False)
-               or validate_io_array(g, (self.m,), 'g')
-               or validate_io_array(obj_val, (), 'obj_val')
-               or validate_io_array(mult_g, (self.m,), 'mult_g')
-               or validate_io_array(mult_x_L, (self.n,), 'mult_x_L')
-               or validate_io_array(mult_x_U, (self.n,), 'mult_x_U'))
-        if exc:
-            raise exc
+        args = x, g, obj_val, mult_g, mult_x_L, mult_x_U
+        for a, spec in zip(args, self._solve_specs):
+            exc = validate_io_array(a, *spec)
+            if exc:
+                raise exc
         return bare.IpoptSolve(self._problem, data_ptr(x), data_ptr(g),
                                data_ptr(obj_val), data_ptr(mult_g),
-                               data_ptr(mult_x_L), data_ptr(mult_x_U), None)
+                               data_ptr(mult_x_L), data_ptr(mult_x_U),
+                               self._user_data)
         
     def __enter__(self):
         if not self._problem:
@@ -145,90 +216,184 @@ class Problem:
         self.free()
 
 
-def wrap_f(f, handler=default_handler):
-    @functools.wraps(f)
+def wrap_callbacks(f, g, grad_f, jac_g, h, handler, trampolines=None):
+    """Wrap the problem callbacks into the IPOPT callback types."""
+    eval_f = wrap_f(f, handler, trampolines)
+    eval_g = wrap_g(g, handler, trampolines)
+    eval_grad_f = wrap_grad_f(grad_f, handler, trampolines)
+    eval_jac_g = wrap_jac_g(jac_g, handler, trampolines)
+    if h is not None:
+        eval_h = wrap_h(h, handler, trampolines)
+    else:
+        eval_h = bare.Eval_H_CB()
+    return eval_f, eval_g, eval_grad_f, eval_jac_g, eval_h
+
+
+cached_wrap_callbacks = functools.lru_cache(maxsize=32)(wrap_callbacks)
+"""Memoized `wrap_callbacks`, for problems created repeatedly.
+
+The wrappers reference the functions, so the cache keeps the functions of the
+last 32 problems alive.
+"""
+
+
+def wrap_f(f, handler=default_handler, trampolines=None):
+    if is_jitted(f):
+        from . import njit_callbacks
+        f = njit_callbacks.cfunc_f(f)
+    if is_compiled(f):
+        return compiled_callback(f, bare.Eval_F_CB)
+    if trampolines is not None:
+        return ctypes.cast(trampolines.set_f(f), bare.Eval_F_CB)
+
+    handler = handler if callable(handler) else None
+    x_view = view_cache()
+    obj_value_view = view_cache()
+
     @bare.Eval_F_CB
     def wrapper(n, x, new_x, obj_value, user_data):
         try:
-            x_array = as_array(x, (n,))
-            obj_value_array = as_array(obj_value, ())
+            x_array = x_view(x, (n,))
+            obj_value_array = obj_value_view(obj_value, ())
             return f(x_array, new_x, obj_value_array)
         except BaseException as e:
-            if callable(handler):
+            if handler is not None:
                 handler(e)
             return 0
+    wrapper._user_fn = f
     return wrapper
 
 
-def wrap_grad_f(grad_f, handler=default_handler):
-    @functools.wraps(grad_f)
+def wrap_grad_f(grad_f, handler=default_handler, trampolines=None):
+    if is_jitted(grad_f):
+        from . import njit_callbacks
+        grad_f = njit_callbacks.cfunc_grad_f(grad_f)
+    if is_compiled(grad_f):
+        return compiled_callback(grad_f, bare.Eval_Grad_F_CB)
+    if trampolines is not None:
+        return ctypes.cast(trampolines.set_grad_f(grad_f), bare.Eval_Grad_F_CB)
+
+    handler = handler if callable(handler) else None
+    x_view = view_cache()
+    grad_f_view = view_cache()
+
     @bare.Eval_Grad_F_CB
     def wrapper(n, x, new_x, grad_ptr, user_data):
         try:
-            x_array = as_array(x, (n,))
-            grad_f_array = as_array(grad_ptr, (n,))
+            x_array = x_view(x, (n,))
+            grad_f_array = grad_f_view(grad_ptr, (n,))
             return grad_f(x_array, new_x, grad_f_array)
         except BaseException as e:
-            if callable(handler):
+            if handler is not None:
                 handler(e)
-            return 0        
+            return 0
+    wrapper._user_fn = grad_f
     return wrapper
 
 
-def wrap_g(g, handler=default_handler):
-    @functools.wraps(g)
+def wrap_g(g, handler=default_handler, trampolines=None):
+    if is_jitted(g):
+        from . import njit_callbacks
+        g = njit_callbacks.cfunc_g(g)
+    if is_compiled(g):
+        return compiled_callback(g, bare.Eval_G_CB)
+    if trampolines is not None:
+        return ctypes.cast(trampolines.set_g(g), bare.Eval_G_CB)
+
+    handler = handler if callable(handler) else None
+    x_view = view_cache()
+    g_view = view_cache()
+
     @bare.Eval_G_CB
     def wrapper(n, x, new_x, m, g_ptr, user_data):
         try:
-            x_array = as_array(x, (n,))
-            g_array = as_array(g_ptr, (m,))
+            x_array = x_view(x, (n,))
+            g_array = g_view(g_ptr, (m,))
             return g(x_array, new_x, g_array)
         except BaseException as e:
-            if callable(handler):
+            if handler is not None:
                 handler(e)
             return 0
+    wrapper._user_fn = g
     return wrapper
 
 
-def wrap_jac_g(jac_g, handler=default_handler):
-    @functools.wraps(jac_g)
+def wrap_jac_g(jac_g, handler=default_handler, trampolines=None):
+    if is_jitted(jac_g):
+        from . import njit_callbacks
+        jac_g = njit_callbacks.cfunc_jac_g(jac_g)
+    if is_compiled(jac_g):
+        return compiled_callback(jac_g, bare.Eval_Jac_G_CB)
+    if trampolines is not None:
+        return ctypes.cast(trampolines.set_jac_g(jac_g), bare.Eval_Jac_G_CB)
+
+    handler = handler if callable(handler) else None
+    x_view = view_cache()
+    i_view = view_cache(bare.c_int)
+    j_view = view_cache(bare.c_int)
+    values_view = view_cache()
+
     @bare.Eval_Jac_G_CB
     def wrapper(n, x, new_x, m, nele_jac, iRow, jCol, values, user_data):
         try:
-            x_array = as_array(x, (n,)) if x else None
-            i_array = as_array(iRow, (nele_jac,)) if iRow else None
-            j_array = as_array(jCol, (nele_jac,)) if jCol else None
-            values_array = as_array(values, (nele_jac,)) if values else None
-            return jac_g(x_array, new_x, i_array, j_array, values_array)
+            # Values are requested with NULL indices and vice versa
+            if values:
+                x_array = x_view(x, (n,))
+                values_array = values_view(values, (nele_jac,))
+                return jac_g(x_array, new_x, None, None, values_array)
+            i_array = i_view(iRow, (nele_jac,))
+            j_array = j_view(jCol, (nele_jac,))
+            return jac_g(None, new_x, i_array, j_array, None)
         except BaseException as e:
-            if callable(handler):
+            if handler is not None:
                 handler(e)
             return 0
+    wrapper._user_fn = jac_g
     return wrapper
 
 
-def wrap_h(h, handler=default_handler):
-    @functools.wraps(h)
+def wrap_h(h, handler=default_handler, trampolines=None):
+    if is_jitted(h):
+        from . import njit_callbacks
+        h = njit_callbacks.cfunc_h(h)
+    if is_compiled(h):
+        return compiled_callback(h, bare.Eval_H_CB)
+    if trampolines is not None:
+        return ctypes.cast(trampolines.set_h(h), bare.Eval_H_CB)
+
+    handler = handler if callable(handler) else None
+    x_view = view_cache()
+    mult_view = view_cache()
+    i_view = view_cache(bare.c_int)
+    j_view = view_cache(bare.c_int)
+    values_view = view_cache()
+
     @bare.Eval_H_CB
     def wrapper(n, x, new_x, obj_factor, m, mult, new_mult, nele_hess,
                 iRow, jCol, values, user_data):
         try:
-            x_array = as_array(x, (n,)) if x else None
-            mult_array = as_array(mult, (m,)) if mult else None
-            i_array = as_array(iRow, (nele_hess,)) if iRow else None
-            j_array = as_array(jCol, (nele_hess,)) if jCol else None
-            values_array = as_array(values, (nele_hess,)) if values else None
-            return h(x_array, new_x, obj_factor, mult_array, new_mult,
-                     i_array, j_array, values_array)
+            # Values are requested with NULL indices and vice versa
+            if values:
+                x_array = x_view(x, (n,))
+                mult_array = mult_view(mult, (m,)) if mult else None
+                values_array = values_view(values, (nele_hess,))
+                return h(x_array, new_x, obj_factor, mult_array, new_mult,
+                         None, None, values_array)
+            i_array = i_view(iRow, (nele_hess,))
+            j_array = j_view(jCol, (nele_hess,))
+            return h(None, new_x, obj_factor, None, new_mult,
+                     i_array, j_array, None)
         except BaseException as e:
-            if callable(handler):
+            if handler is not None:
                 handler(e)
             return 0
+    wrapper._user_fn = h
     return wrapper
 
 
 def wrap_intermediate_cb(cb, handler=default_handler):
-    @functools.wraps(cb)
+    handler = handler if callable(handler) else None
+
     @bare.Intermediate_CB
     def wrapper(alg_mod, iter_count, obj_value, inf_pr, inf_du, mu, d_norm,
 		regularization_size, alpha_du, alpha_pr, ls_trials, user_data):
@@ -236,22 +401,137 @@ def wrap_intermediate_cb(cb, handler=default_handler):
             return cb(alg_mod, iter_count, obj_value, inf_pr, inf_du, mu, 
                       d_norm, regularization_size, alpha_du, alpha_pr,ls_trials)
         except BaseException as e:
-            if callable(handler):
+            if handler is not None:
                 handler(e)
             return 0
+    wrapper._user_fn = cb
     return wrapper
 
 
+def view_cache(ctype=bare.c_double, maxsize=8):
+    """Make a function returning cached ndarray views of ctypes pointers.
+
+    IPOPT passes a few buffers to the callbacks over and over during a solve,
+    so the views are cached by address and shape. The cache is cleared when
+    it reaches `maxsize` entries.
+    """
+    dtype = np.dtype(ctype)  # Converting from ctypes on each call is slow
+    cache = {}
+    
+    # Bind the names used on every call, avoiding global and attribute lookups
+    addressof = ctypes.addressof
+    cache_get = cache.get
+
+    def view(ptr, shape):
+        key = addressof(ptr.contents), shape
+        cached_view = cache_get(key)
+        if cached_view is None:
+            if len(cache) >= maxsize:
+                cache.clear()
+            buf = (ctype * math.prod(shape)).from_address(key[0])
+            cached_view = cache[key] = np.ndarray(shape, dtype, buf)
+        return cached_view
+    return view
+
+
+def is_hashable(obj):
+    """Whether `obj` can be a key of the callback wrapper cache."""
+    try:
+        hash(obj)
+    except TypeError:
+        return False
+    return True
+
+
+def is_jitted(cb):
+    """Whether `cb` is a function compiled with `numba.njit`."""
+    return type(cb).__module__.startswith('numba.') and hasattr(cb, 'py_func')
+
+
+def is_low_level_callable(cb):
+    """Whether `cb` is a `scipy.LowLevelCallable`."""
+    cls = type(cb)
+    return (cls.__name__ == 'LowLevelCallable'
+            and cls.__module__.startswith('scipy.'))
+
+
+def is_compiled(cb):
+    """Whether `cb` is a compiled callback, such as a `numba.cfunc`.
+
+    A `scipy.LowLevelCallable` is also accepted, its `user_data` is ignored.
+    Its signature must match the IPOPT callback, as in `_low_level_signatures`.
+    """
+    return (isinstance(getattr(cb, 'address', None), int)
+            or is_low_level_callable(cb))
+
+
+_capsule_name = ctypes.PYFUNCTYPE(ctypes.c_char_p, ctypes.py_object)(
+    ('PyCapsule_GetName', ctypes.pythonapi)
+)
+
+
+_capsule_pointer = ctypes.PYFUNCTYPE(
+    ctypes.c_void_p, ctypes.py_object, ctypes.c_char_p
+)(('PyCapsule_GetPointer', ctypes.pythonapi))
+
+
+_low_level_signatures = {
+    bare.Eval_F_CB: 'int (int, double *, int, double *, void *)',
+    bare.Eval_Grad_F_CB: 'int (int, double *, int, double *, void *)',
+    bare.Eval_G_CB: 'int (int, double *, int, int, double *, void *)',
+    bare.Eval_Jac_G_CB: (
+        'int (int, double *, int, int, int, int *, int *, double *, void *)'
+    ),
+    bare.Eval_H_CB: (
+        'int (int, double *, int, double, int, double *, int, int, '
+        'int *, int *, double *, void *)'
+    ),
+}
+"""`scipy.LowLevelCallable` signatures of the IPOPT callback types."""
+
+
+def compiled_callback(cb, cbtype):
+    """Cast the compiled callback `cb` to the ctypes function type `cbtype`."""
+    if is_low_level_callable(cb):
+        expected = _low_level_signatures[cbtype]
+        if cb.signature != expected:
+            raise ValueError(f"LowLevelCallable signature '{cb.signature}' "
+                             f"does not match '{expected}'")
+        # The capsule is the first item of the LowLevelCallable tuple
+        capsule = tuple.__getitem__(cb, 0)
+        address = _capsule_pointer(capsule, _capsule_name(capsule))
+    else:
+        address = cb.address
+    ptr = ctypes.cast(address, cbtype)
+    ptr._compiled = cb  # Keep the compiled code alive
+    return ptr
+
+
+_ALIGNED_WRITEABLE = 0x100 | 0x400
+"""Mask of the NPY_ARRAY_ALIGNED and NPY_ARRAY_WRITEABLE array flags."""
+
+
+_ALIGNED_CONTIGUOUS = 0x100 | 0x1
+"""Mask of the NPY_ARRAY_ALIGNED and NPY_ARRAY_C_CONTIGUOUS array flags."""
+
+
+def _as_double(a):
+    """Convert to an aligned C-contiguous array of doubles, if not already."""
+    if (type(a) is np.ndarray and a.dtype == np.double
+        and a.flags.num & _ALIGNED_CONTIGUOUS == _ALIGNED_CONTIGUOUS):
+        return a
+    return np.require(a, np.double, ['A', 'C'])
+
+
 def validate_io_array(a, shape, name, none_ok=True):
-    if none_ok and a is None:
+    if a is None and none_ok:
         return
-    if none_ok and not isinstance(a, np.ndarray):
-        return TypeError(f'{name} must be a numpy ndarray instance or None')
-    if not none_ok and not isinstance(a, np.ndarray):
-        return TypeError(f'{name} must be a numpy ndarray instance')
+    if not isinstance(a, np.ndarray):
+        or_none = ' or None' if none_ok else ''
+        return TypeError(f'{name} must be a numpy ndarray instance{or_none}')
     if a.dtype != np.double:
         return TypeError(f'{name} must be an array of doubles')
-    if not (a.flags['A'] and a.flags['W']):
+    if a.flags.num & _ALIGNED_WRITEABLE != _ALIGNED_WRITEABLE:
         return ValueError(f'{name} must be an aligned writeable array')
     if a.shape != shape:
         return ValueError(f'invalid shape for {name}')
@@ -262,4 +542,10 @@ def data_ptr(arr):
         return arr
     assert isinstance(arr, np.ndarray)
     assert arr.dtype == np.double
-    return arr.ctypes.data_as(bare.c_double_p) if arr.size else None
+    if not arr.size:
+        return None
+    try:
+        # Faster than `data_as`, but only for writeable contiguous arrays
+        return bare.c_double_p(bare.c_double.from_buffer(arr))
+    except TypeError:
+        return arr.ctypes.data_as(bare.c_double_p)
@@ -3,6 +3,7 @@
 
 import functools
 import inspect
+import types
 
 import numpy as np
 
@@ -10,24 +11,84 @@ from . import bare_np
 
 
 class Problem(bare_np.Problem):
+    """Nonlinear programming problem.
+
+    The `g` and `grad` functions and the `jac_val` and `hess_val` functions of
+    `jac` and `hess` can either return their values or, if they accept an
+    `out` argument, write them to it. The latter avoids temporary allocations.
+
+    If the objective and its gradient are cheaper to compute together, as with
+    many automatic differentiation tools, a function `fg` returning both can
+    be given instead of `f` and `grad`, which must then be None. Its result is
+    reused while IPOPT evaluates the problem at the same point, within a
+    single `solve`.
+
+    The numbers of nonzero elements `nele_jac` and `nele_hess` default to the
+    number of indices returned by the first element of `jac` and `hess`.
+
+    The arrays in the `info` returned by `solve` which are not given by the
+    caller are reused by the next solve and must be copied to be kept.
+
+    Functions compiled with `numba.njit` are called from compiled callbacks,
+    without going through the python interpreter, see `njit_problem`.
+    """
+
     def __init__(self, x_bounds, g_bounds, f, g, grad,
-                 jac, nele_jac, hess=None, nele_hess=None):
-        if hess is not None and nele_hess is None:
-            raise TypeError("'nele_hess' must be given if 'hess' is supplied")
-        if hess is None:
+                 jac, nele_jac=None, hess=None, nele_hess=None, *, fg=None):
+        if fg is None and (f is None or grad is None):
+            raise TypeError("'f' and 'grad' must be given if 'fg' is not")
+        if fg is not None and (f is not None or grad is not None):
+            raise TypeError("'f' and 'grad' must be None if 'fg' is given")
+        
+        # Evaluate the sparsity structure only once, as contiguous arrays
+        # copied with a single memcpy, and check for overflow, which can lead
+        # to segfault
+        n = np.size(x_bounds[0])
+        m = np.size(g_bounds[0])
+        jac_ind, jac_val = jac
+        self._jac_ind = sparse_indices(jac_ind)
+        if nele_jac is None:
+            nele_jac = self._jac_ind[0].size
+        check_indices(self._jac_ind, nele_jac, m, n, 'Jacobian')
+        if hess is not None:
+            hess_ind, hess_val = hess
+            self._hess_ind = sparse_indices(hess_ind)
+            if nele_hess is None:
+                nele_hess = self._hess_ind[0].size
+            check_indices(self._hess_ind, nele_hess, n, n, 'Hessian')
+        else:
             nele_hess = 0
         
         # Create callbacks
-        f_cb = f_callback(f)
-        grad_cb = grad_callback(grad)
-        g_cb = g_callback(g)
-        jac_cb = jac_callback(jac, self)
-        hess_cb = hess_callback(hess, self)
+        self._clear_fg_cache = None
+        if fg is None:
+            f_cb = f_callback(f)
+            grad_cb = grad_callback(grad)
+        else:
+            f_cb, grad_cb, self._clear_fg_cache = fg_callbacks(fg)
+        # Empty functions and matrices have nothing to evaluate
+        g_cb = g_callback(g) if m else empty_callback
+        jac_cb = empty_callback
+        if nele_jac:
+            jac_cb = jac_callback(jac_val, self._jac_ind)
+        hess_cb = None if hess is None else empty_callback
+        if nele_hess:
+            hess_cb = hess_callback(hess_val, self._hess_ind)
         
+        # The callbacks are new closures and the handler references the
+        # problem, so caching their wrappers would only keep `self` alive
         handler = self._callback_exception_handler
         super().__init__(x_bounds, g_bounds, nele_jac, nele_hess, 0,
-                         f_cb, g_cb, grad_cb, jac_cb, hess_cb, handler=handler)
+                         f_cb, g_cb, grad_cb, jac_cb, hess_cb, handler=handler,
+                         cache_callbacks=False)
         self.set_intermediate_callback(self._intermediate_callback)
+        
+        # Output buffers, reused across solves
+        self._g = np.empty(m)
+        self._obj_val = np.empty(())
+        self._mult_g = np.empty(m)
+        self._mult_x_L = np.empty(n)
+        self._mult_x_U = np.empty(n)
     
     def _intermediate_callback(self, *args):
         return 0 if getattr(self, '_abort', False) else 1
@@ -40,20 +101,43 @@ class Problem(bare_np.Problem):
             return
         bare_np.default_handler(e)
     
+    def add_str_option(self, keyword, val):
+        super().add_str_option(keyword, val)
+        self._warm_start_state = None  # The option might have been changed
+    
     def solve(self, x, mult_g=None, mult_x_L=None, mult_x_U=None, copy=True):
-        if any(m is not None for m in (mult_g, mult_x_L, mult_x_U)):
-            self.add_str_option('warm_start_init_point', 'yes')
-        else:
-            self.add_str_option('warm_start_init_point', 'no')
+        # `fg` may depend on parameters changed since the last solve
+        if self._clear_fg_cache is not None:
+            self._clear_fg_cache()
         
-        mult_g = np.zeros(self.m) if mult_g is None else mult_g
-        mult_x_L = np.zeros(self.n) if mult_x_L is None else mult_x_L
-        mult_x_U = np.zeros(self.n) if mult_x_U is None else mult_x_U
+        # Only set the warm start option when it changes
+        warm_start = any(m is not None for m in (mult_g, mult_x_L, mult_x_U))
+        if warm_start != getattr(self, '_warm_start_state', None):
+            value = 'yes' if warm_start else 'no'
+            super().add_str_option('warm_start_init_point', value)
+            self._warm_start_state = warm_start
         
-        g = np.empty(self.m)
-        obj_val = np.empty(())
+        # IPOPT only reads the initial multipliers on warm starts
+        if mult_g is None:
+            mult_g = self._mult_g
+            if warm_start:
+                mult_g.fill(0)
+        if mult_x_L is None:
+            mult_x_L = self._mult_x_L
+            if warm_start:
+                mult_x_L.fill(0)
+        if mult_x_U is None:
+            mult_x_U = self._mult_x_U
+            if warm_start:
+                mult_x_U.fill(0)
+        
+        g = self._g
+        obj_val = self._obj_val
         if copy:
             x = np.array(x, np.double, copy=True, order='C')
+        else:
+            # Arrays which can be used directly are solved in place
+            x = np.require(x, np.double, ['A', 'C', 'W'])
         
         status = super().solve(x, g, obj_val, mult_g, mult_x_L, mult_x_U)
         info = dict(g=g, obj_val=obj_val, mult_g=mult_g,
@@ -61,11 +145,37 @@ class Problem(bare_np.Problem):
         return x, info
 
 
+def njit_problem(x_bounds, g_bounds, f, g, grad, jac, nele_jac=None,
+                 hess=None, nele_hess=None):
+    """Create a `Problem` with all its functions compiled with `numba.njit`.
+
+    Functions which are not already jitted are compiled with caching to disk.
+    Exceptions raised by compiled functions, including `InvalidPoint`, only
+    signal the failure to IPOPT and are not reported.
+    """
+    import numba
+    
+    def jit(fn):
+        return fn if bare_np.is_jitted(fn) else numba.njit(cache=True)(fn)
+    
+    jac_ind, jac_val = jac
+    jac = jac_ind, jit(jac_val)
+    if hess is not None:
+        hess_ind, hess_val = hess
+        hess = hess_ind, jit(hess_val)
+    return Problem(x_bounds, g_bounds, jit(f), jit(g), jit(grad),
+                   jac, nele_jac, hess, nele_hess)
+
+
 class InvalidPoint(RuntimeError):
     """Exception raised in callback to signal an invalid decision by IPOPT."""
 
 
 def f_callback(f):
+    if bare_np.is_jitted(f):
+        from . import njit_callbacks
+        return njit_callbacks.ez_f(f)
+    
     @functools.wraps(f)
     def wrapper(x, new_x, obj_value):
         obj_value[()] = f(x)
@@ -75,80 +185,159 @@ def f_callback(f):
 
 
 def grad_callback(grad):
+    if bare_np.is_jitted(grad):
+        from . import njit_callbacks
+        return njit_callbacks.ez_grad(grad, accepts_output(grad))
+    
     @functools.wraps(grad)
     def wrapper(x, new_x, grad_array):
         grad_array[()] = grad(x)
         return 1
-    return wrapper
+    
+    @functools.wraps(grad)
+    def out_wrapper(x, new_x, grad_array):
+        grad(x, out=grad_array)
+        return 1
+    
+    return out_wrapper if accepts_output(grad) else wrapper
+
+
+def fg_callbacks(fg):
+    cached_x = None
+    cached_fg = None
+    def evaluate(x):
+        nonlocal cached_x, cached_fg
+        if cached_x is None or not np.array_equal(x, cached_x):
+            cached_fg = fg(x)
+            cached_x = x.copy()
+        return cached_fg
+    
+    def clear_cache():
+        nonlocal cached_x, cached_fg
+        cached_x = cached_fg = None
+    
+    def f_wrapper(x, new_x, obj_value):
+        obj_value[()] = evaluate(x)[0]
+        return 1
+    
+    def grad_wrapper(x, new_x, grad_array):
+        grad_array[()] = evaluate(x)[1]
+        return 1
+    
+    return f_wrapper, grad_wrapper, clear_cache
 
 
 def g_callback(g):
+    if bare_np.is_jitted(g):
+        from . import njit_callbacks
+        return njit_callbacks.ez_g(g, accepts_output(g))
+    
     def wrapper(x, new_x, g_array):
-        if g_array.size:
-            g_array[()] = g(x)
+        g_array[()] = g(x)
         return 1
-    return wrapper
+    
+    def out_wrapper(x, new_x, g_array):
+        g(x, out=g_array)
+        return 1
+    
+    return out_wrapper if accepts_output(g) else wrapper
 
 
-def jac_callback(jac, problem):
-    jac_ind, jac_val = jac
+def jac_callback(jac_val, ind):
+    if bare_np.is_jitted(jac_val):
+        from . import njit_callbacks
+        ind_key = tuple(tuple(a.tolist()) for a in ind)
+        return njit_callbacks.ez_jac(jac_val, accepts_output(jac_val), ind_key)
+    
+    # The values are requested with the indices None and vice versa; the
+    # output protocol is resolved here so that each call is a single frame
+    i, j = ind
     def wrapper(x, new_x, iRow, jCol, values):
-        # Fill out Jacobian values
         if values is not None:
-            if values.size == 0:
-                return 1
-            if accepts_output(jac_val):
-                jac_val(x, out=values)
-            else:
-                values[...] = jac_val(x)
-            return 1
-        
-        # Fill out jacobian indices
-        if iRow is None or jCol is None or iRow.size == 0 or jCol.size == 0:
-            return 1
-        i, j = jac_ind() if callable(jac_ind) else jac_ind
-        iRow[...] = i
-        jCol[...] = j
-        # Check indices for overflow, can lead to segfault
-        assert np.all(iRow < problem.m), "row index overflow"
-        assert np.all(jCol < problem.n), "column index overflow"
+            values[...] = jac_val(x)
+        else:
+            np.copyto(iRow, i)
+            np.copyto(jCol, j)
         return 1
     
-    return wrapper
+    def out_wrapper(x, new_x, iRow, jCol, values):
+        if values is not None:
+            jac_val(x, out=values)
+        else:
+            np.copyto(iRow, i)
+            np.copyto(jCol, j)
+        return 1
+    
+    return out_wrapper if accepts_output(jac_val) else wrapper
 
 
-def hess_callback(hess, problem):
-    if hess is None:
-        return
+def hess_callback(hess_val, ind):
+    if bare_np.is_jitted(hess_val):
+        from . import njit_callbacks
+        ind_key = tuple(tuple(a.tolist()) for a in ind)
+        has_out = accepts_output(hess_val)
+        return njit_callbacks.ez_hess(hess_val, has_out, ind_key)
     
-    hess_ind, hess_val = hess    
+    # The values are requested with the indices None and vice versa; the
+    # output protocol is resolved here so that each call is a single frame
+    i, j = ind
     def wrapper(x, new_x, obj_factor, mult, new_mult, iRow, jCol, values):
-        # Fill out Hessian values
         if values is not None:
-            if values.size == 0:
-                return 1
-            if accepts_output(hess_val):
-                hess_val(x, obj_factor, mult, out=values)
-            else:
-                values[...] = hess_val(x, obj_factor, mult)
-            return 1
-        
-        # Fill out jacobian indices
-        if iRow is None or jCol is None or iRow.size == 0 or jCol.size == 0:
-            return 1
-        i, j = hess_ind() if callable(hess_ind) else hess_ind
-        iRow[...] = i
-        jCol[...] = j
-        # Check indices for overflow, can lead to segfault
-        assert np.all(iRow < problem.n), "row index overflow"
-        assert np.all(jCol < problem.n), "column index overflow"
+            values[...] = hess_val(x, obj_factor, mult)
+        else:
+            np.copyto(iRow, i)
+            np.copyto(jCol, j)
         return 1
     
-    return wrapper
+    def out_wrapper(x, new_x, obj_factor, mult, new_mult, iRow, jCol, values):
+        if values is not None:
+            hess_val(x, obj_factor, mult, out=values)
+        else:
+            np.copyto(iRow, i)
+            np.copyto(jCol, j)
+        return 1
+    
+    return out_wrapper if accepts_output(hess_val) else wrapper
+
+
+def empty_callback(*args):
+    """Callback of an empty function or matrix, with nothing to evaluate."""
+    return 1
+
+
+def sparse_indices(ind):
+    """Row and column indices of a sparse matrix as arrays of c ints.
+
+    `ind` is either a (row, col) pair of sequences or a function returning it.
+    """
+    i, j = ind() if callable(ind) else ind
+    return np.ascontiguousarray(i, np.intc), np.ascontiguousarray(j, np.intc)
+
+
+def check_indices(ind, nele, rows, cols, name):
+    """Check the sparse matrix indices for inconsistent sizes and overflow."""
+    i, j = ind
+    if i.shape != (nele,) or j.shape != (nele,):
+        raise ValueError(f"{name} indices must have {nele} elements")
+    if np.any(i >= rows):
+        raise ValueError(f"{name} row index overflow")
+    if np.any(j >= cols):
+        raise ValueError(f"{name} column index overflow")
 
 
-@functools.lru_cache()
 def accepts_output(f):
+    """Whether `f` accepts an `out` argument after the first one."""
+    # Read the arguments of plain functions from their code, which is faster
+    # than `inspect.signature`
+    plain = (type(f) is types.FunctionType
+             and not hasattr(f, '__wrapped__')
+             and not hasattr(f, '__signature__'))
+    if plain:
+        code = f.__code__
+        names = code.co_varnames
+        nargs = code.co_argcount + code.co_kwonlyargcount
+        return 'out' in names[max(code.co_posonlyargcount, 1):nargs]
+    
     params = inspect.signature(f).parameters
     out = params.get('out', None)
     if out is None:
@@ -159,5 +348,5 @@ def accepts_output(f):
         return False
     
     kinds = inspect.Parameter
-    return out.kind == kinds.POSITIONAL_OR_KEYWORD or kinds.KEYWORD_ONLY
+    return out.kind in (kinds.POSITIONAL_OR_KEYWORD, kinds.KEYWORD_ONLY)
             
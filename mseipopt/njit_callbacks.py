@@ -0,0 +1,254 @@
+"""Numba signatures of the IPOPT c interface callbacks.
+
+User callbacks compiled with `numba.cfunc` using these signatures can be
+passed directly to `bare_np.Problem` in place of the python callables. IPOPT
+then calls the compiled machine code directly, without going through the
+python interpreter. The names are the same as the callback types in `bare`.
+
+The callbacks receive raw pointers, `numba.carray` can be used to view them
+as arrays, for example::
+
+    @numba.cfunc(njit_callbacks.Eval_F_CB, nopython=True, cache=True)
+    def f(n, x, new_x, obj_value, user_data):
+        x_array = numba.carray(x, (n,))
+        obj_value[0] = np.sum(x_array ** 2)
+        return 1
+
+Null pointers, as the `values` argument of `Eval_Jac_G_CB` when IPOPT asks for
+the sparsity structure, can be tested with `is_null`.
+
+Alternatively, functions compiled with `numba.njit` taking the same arguments
+as the `bare_np` callbacks can be passed to `bare_np.Problem`, which wraps
+them with the `cfunc_*` functions of this module. As the arguments which are
+None depend on the call, each one must be tested separately in the function,
+as in ``if values is not None: ...``, so that numba can prune the branches.
+
+The `ez_*` functions build such jitted callbacks from the jitted functions of
+`ez.Problem`, so that IPOPT evaluates a problem without going through the
+python interpreter. Exceptions raised in compiled code are not reported, the
+callback just signals the failure to IPOPT.
+"""
+
+
+import functools
+
+import numpy as np
+from llvmlite import ir
+from numba import carray, cfunc, njit, types
+from numba.extending import intrinsic
+
+
+c_double_p = types.CPointer(types.float64)
+"""Pointer to double."""
+
+
+c_int_p = types.CPointer(types.intc)
+"""Pointer to int."""
+
+
+Eval_F_CB = types.intc(types.intc, c_double_p, types.intc,
+                       c_double_p, types.voidptr)
+"""Signature of the callback for evaluating the objective function."""
+
+
+Eval_Grad_F_CB = types.intc(types.intc, c_double_p, types.intc,
+                            c_double_p, types.voidptr)
+"""Signature of the callback for evaluating the gradient of the objective."""
+
+
+Eval_G_CB = types.intc(types.intc, c_double_p, types.intc,
+                       types.intc, c_double_p, types.voidptr)
+"""Signature of the callback for evaluating the constraint function."""
+
+
+Eval_Jac_G_CB = types.intc(types.intc, c_double_p, types.intc,
+                           types.intc, types.intc,
+                           c_int_p, c_int_p, c_double_p,
+                           types.voidptr)
+"""Signature of the callback for evaluating the Jacobian of the constraint."""
+
+
+Eval_H_CB = types.intc(types.intc, c_double_p, types.intc, types.float64,
+                       types.intc, c_double_p, types.intc,
+                       types.intc, c_int_p, c_int_p,
+                       c_double_p, types.voidptr)
+"""Signature of the callback for evaluating the Hessian of the Lagrangian."""
+
+
+@intrinsic
+def is_null(typingctx, ptr):
+    """Whether the pointer argument `ptr` of a compiled callback is NULL."""
+    if isinstance(ptr, types.CPointer):
+        def codegen(context, builder, signature, args):
+            [ptr] = args
+            null = ir.Constant(ptr.type, None)
+            return builder.icmp_unsigned('==', ptr, null)
+        return types.boolean(ptr), codegen
+
+
+@functools.lru_cache()
+def cfunc_f(f):
+    """Compiled `Eval_F_CB` calling a jitted `bare_np` callback."""
+    @cfunc(Eval_F_CB, nopython=True)
+    def wrapper(n, x, new_x, obj_value, user_data):
+        try:
+            return f(carray(x, (n,)), new_x, carray(obj_value, ()))
+        except Exception:
+            return 0
+    return wrapper
+
+
+@functools.lru_cache()
+def cfunc_grad_f(grad_f):
+    """Compiled `Eval_Grad_F_CB` calling a jitted `bare_np` callback."""
+    @cfunc(Eval_Grad_F_CB, nopython=True)
+    def wrapper(n, x, new_x, grad_ptr, user_data):
+        try:
+            return grad_f(carray(x, (n,)), new_x, carray(grad_ptr, (n,)))
+        except Exception:
+            return 0
+    return wrapper
+
+
+@functools.lru_cache()
+def cfunc_g(g):
+    """Compiled `Eval_G_CB` calling a jitted `bare_np` callback."""
+    @cfunc(Eval_G_CB, nopython=True)
+    def wrapper(n, x, new_x, m, g_ptr, user_data):
+        try:
+            return g(carray(x, (n,)), new_x, carray(g_ptr, (m,)))
+        except Exception:
+            return 0
+    return wrapper
+
+
+@functools.lru_cache()
+def cfunc_jac_g(jac_g):
+    """Compiled `Eval_Jac_G_CB` calling a jitted `bare_np` callback."""
+    @cfunc(Eval_Jac_G_CB, nopython=True)
+    def wrapper(n, x, new_x, m, nele_jac, iRow, jCol, values, user_data):
+        try:
+            if is_null(values):
+                i_array = carray(iRow, (nele_jac,))
+                j_array = carray(jCol, (nele_jac,))
+                return jac_g(None, new_x, i_array, j_array, None)
+            x_array = carray(x, (n,))
+            values_array = carray(values, (nele_jac,))
+            return jac_g(x_array, new_x, None, None, values_array)
+        except Exception:
+            return 0
+    return wrapper
+
+
+@functools.lru_cache()
+def cfunc_h(h):
+    """Compiled `Eval_H_CB` calling a jitted `bare_np` callback."""
+    @cfunc(Eval_H_CB, nopython=True)
+    def wrapper(n, x, new_x, obj_factor, m, mult, new_mult, nele_hess,
+                iRow, jCol, values, user_data):
+        try:
+            if is_null(values):
+                i_array = carray(iRow, (nele_hess,))
+                j_array = carray(jCol, (nele_hess,))
+                return h(None, new_x, obj_factor, None, new_mult,
+                         i_array, j_array, None)
+            x_array = carray(x, (n,))
+            mult_array = carray(mult, (m,))
+            values_array = carray(values, (nele_hess,))
+            return h(x_array, new_x, obj_factor, mult_array, new_mult,
+                     None, None, values_array)
+        except Exception:
+            return 0
+    return wrapper
+
+
+@functools.lru_cache()
+def ez_f(f):
+    """Jitted `bare_np` objective callback calling an `ez` function."""
+    @njit
+    def wrapper(x, new_x, obj_value):
+        obj_value[()] = f(x)
+        return 1
+    return wrapper
+
+
+@functools.lru_cache()
+def ez_grad(grad, has_out):
+    """Jitted `bare_np` gradient callback calling an `ez` function."""
+    grad_out = grad
+    if not has_out:
+        @njit
+        def grad_out(x, out):
+            out[...] = grad(x)
+    
+    @njit
+    def wrapper(x, new_x, grad_array):
+        grad_out(x, out=grad_array)
+        return 1
+    return wrapper
+
+
+@functools.lru_cache()
+def ez_g(g, has_out):
+    """Jitted `bare_np` constraint callback calling an `ez` function."""
+    g_out = g
+    if not has_out:
+        @njit
+        def g_out(x, out):
+            out[...] = g(x)
+    
+    @njit
+    def wrapper(x, new_x, g_array):
+        g_out(x, out=g_array)
+        return 1
+    return wrapper
+
+
+@functools.lru_cache()
+def ez_jac(jac_val, has_out, ind):
+    """Jitted `bare_np` Jacobian callback calling an `ez` function.
+
+    The indices `ind` are given as a hashable pair of tuples.
+    """
+    i, j = (np.array(a, np.intc) for a in ind)
+    jac_val_out = jac_val
+    if not has_out:
+        @njit
+        def jac_val_out(x, out):
+            out[...] = jac_val(x)
+    
+    @njit
+    def wrapper(x, new_x, iRow, jCol, values):
+        if iRow is not None:
+            iRow[:] = i
+        if jCol is not None:
+            jCol[:] = j
+        if values is not None:
+            jac_val_out(x, out=values)
+        return 1
+    return wrapper
+
+
+@functools.lru_cache()
+def ez_hess(hess_val, has_out, ind):
+    """Jitted `bare_np` Hessian callback calling an `ez` function.
+
+    The indices `ind` are given as a hashable pair of tuples.
+    """
+    i, j = (np.array(a, np.intc) for a in ind)
+    hess_val_out = hess_val
+    if not has_out:
+        @njit
+        def hess_val_out(x, obj_factor, mult, out):
+            out[...] = hess_val(x, obj_factor, mult)
+    
+    @njit
+    def wrapper(x, new_x, obj_factor, mult, new_mult, iRow, jCol, values):
+        if iRow is not None:
+            iRow[:] = i
+        if jCol is not None:
+            jCol[:] = j
+        if values is not None:
+            hess_val_out(x, obj_factor, mult, out=values)
+        return 1
+    return wrapper
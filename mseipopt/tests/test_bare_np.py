@@ -0,0 +1,183 @@
+"""
+Tests of the numpy IPOPT interface with a one-dimensional quadratic problem.
+"""
+
+
+import ctypes
+import enum
+
+import numpy as np
+import pytest
+
+from mseipopt import bare, bare_np
+
+
+def f(x, new_x, obj_value):
+    """Objective function."""
+    obj_value[()] = (x[0] - 1)**2
+    return 1
+
+
+def grad_f(x, new_x, grad_f):
+    """Gradient of objective function."""
+    grad_f[0] = 2*(x[0] - 1)
+    return 1
+
+
+def g(x, new_x, g):
+    """Constraint function of the unconstrained problem."""
+    return 1
+
+
+def jac_g(x, new_x, iRow, jCol, values):
+    """Constraint Jacobian of the unconstrained problem."""
+    return 1
+
+
+def h(x, new_x, obj_factor, mult, new_mult, iRow, jCol, values):
+    """Lagrangian Hessian, the constraints are linear."""
+    if iRow is not None:
+        iRow[0] = 0
+    if jCol is not None:
+        jCol[0] = 0
+    if values is not None:
+        values[0] = 2 * obj_factor
+    return 1
+
+
+x_b = ([-100], [100])
+g_b = ([], [])
+
+
+def test_njit_callbacks():
+    numba = pytest.importorskip('numba')
+    from mseipopt import njit_callbacks
+    
+    @numba.cfunc(njit_callbacks.Eval_F_CB, nopython=True)
+    def f(n, x, new_x, obj_value, user_data):
+        obj_value[0] = (x[0] - 1)**2
+        return 1
+    
+    @numba.cfunc(njit_callbacks.Eval_Grad_F_CB, nopython=True)
+    def grad_f(n, x, new_x, grad_f, user_data):
+        grad_f[0] = 2*(x[0] - 1)
+        return 1
+    
+    @numba.cfunc(njit_callbacks.Eval_H_CB, nopython=True)
+    def h(n, x, new_x, obj_factor, m, mult, new_mult, nele_hess,
+          iRow, jCol, values, user_data):
+        if not njit_callbacks.is_null(iRow):
+            iRow[0] = 0
+        if not njit_callbacks.is_null(jCol):
+            jCol[0] = 0
+        if not njit_callbacks.is_null(values):
+            values[0] = 2 * obj_factor
+        return 1
+    
+    with bare_np.Problem(x_b, g_b, 0, 1, 0, f, g, grad_f, jac_g, h) as problem:
+        problem.add_int_option('print_level', 0)
+        x = np.array([10.0])
+        obj_val = np.empty(())
+        status = problem.solve(x, None, obj_val, None, None, None)
+    
+    assert status == 0
+    np.testing.assert_almost_equal(x, [1.0])
+    np.testing.assert_almost_equal(obj_val, 0.0)
+
+
+class Solver(str, enum.Enum):
+    """String enumeration of option values."""
+    MUMPS = 'mumps'
+
+
+def test_set_options():
+    options = {'print_level': 0, 'tol': 1e-9, 'linear_solver': 'mumps',
+               'print_timing_statistics': False, 'max_cpu_time': 60}
+    frozen = bare_np.Problem.freeze_options(options)
+    assert frozen[0] == (b'print_level', 0, 'add_int_option')
+    assert frozen[1] == (b'tol', 1e-9, 'add_num_option')
+    assert frozen[2] == (b'linear_solver', b'mumps', 'add_str_option')
+    assert frozen[3] == (b'print_timing_statistics', b'no', 'add_str_option')
+    assert frozen[4] == (b'max_cpu_time', 60, 'add_int_option')
+    
+    with bare_np.Problem(x_b, g_b, 0, 1, 0, f, g, grad_f, jac_g, h) as problem:
+        with pytest.raises(ctypes.ArgumentError):
+            problem.add_int_option(1, 0)
+        problem.add_str_option('linear_solver', np.str_('mumps'))
+        problem.add_str_option('linear_solver', Solver.MUMPS)
+        problem.set_options(options)
+        x = np.array([10.0])
+        status = problem.solve(x)
+    
+    assert status == 0
+    np.testing.assert_almost_equal(x, [1.0])
+
+
+def test_njit_functions():
+    numba = pytest.importorskip('numba')
+    njit = numba.njit
+    callbacks = njit(f), njit(g), njit(grad_f), njit(jac_g), njit(h)
+    with bare_np.Problem(x_b, g_b, 0, 1, 0, *callbacks) as problem:
+        problem.add_int_option('print_level', 0)
+        x = np.array([10.0])
+        status = problem.solve(x)
+    
+    assert status == 0
+    np.testing.assert_almost_equal(x, [1.0])
+
+
+def test_low_level_callables():
+    scipy = pytest.importorskip('scipy')
+    
+    @bare.Eval_F_CB
+    def f_c(n, x, new_x, obj_value, user_data):
+        obj_value[0] = (x[0] - 1)**2
+        return 1
+    
+    @bare.Eval_Grad_F_CB
+    def grad_f_c(n, x, new_x, grad_f, user_data):
+        grad_f[0] = 2*(x[0] - 1)
+        return 1
+    
+    f_ll = scipy.LowLevelCallable(f_c)
+    grad_f_ll = scipy.LowLevelCallable(grad_f_c)
+    with pytest.raises(ValueError):
+        bare_np.Problem(x_b, g_b, 0, 1, 0, f_ll, grad_f_ll, grad_f_ll, jac_g)
+    
+    callbacks = f_ll, g, grad_f_ll, jac_g, h
+    with bare_np.Problem(x_b, g_b, 0, 1, 0, *callbacks) as problem:
+        problem.add_int_option('print_level', 0)
+        x = np.array([10.0])
+        status = problem.solve(x)
+    
+    assert status == 0
+    np.testing.assert_almost_equal(x, [1.0])
+
+
+def test_constrained_callbacks():
+    errors = []
+    
+    def g(x, new_x, g):
+        g[0] = x[0]
+        return 1
+    
+    def jac_g(x, new_x, iRow, jCol, values):
+        if values is None:
+            iRow[0] = jCol[0] = 0
+        else:
+            values[0] = 1
+        return 1
+    
+    g_b = ([2], [3])
+    with bare_np.Problem(x_b, g_b, 1, 1, 0, f, g, grad_f, jac_g, h,
+                         handler=errors.append) as problem:
+        problem.add_int_option('print_level', 0)
+        x = np.array([10.0])
+        mult_g = np.empty(1)
+        status = problem.solve(x, mult_g=mult_g)
+    
+    # No callback evaluation may fail, even when IPOPT recovers from it
+    assert not errors
+    assert status == 0
+    np.testing.assert_almost_equal(x, [2.0])
+    np.testing.assert_almost_equal(mult_g, [-2.0], decimal=6)
@@ -4,70 +4,259 @@ Test of IPOPT interface with problem 71 of the Hock--Schittkowsky test suite.
 
 
 import numpy as np
+import pytest
 
 from mseipopt import ez
 
 
-def test_hs071():
-    def f(x):
-        """Objective function."""
-        return x[0]*x[3]*(x[0] + x[1] + x[2]) + x[2]
+def f(x):
+    """Objective function."""
+    return x[0]*x[3]*(x[0] + x[1] + x[2]) + x[2]
+
+
+def grad(x):
+    """Gradient of objective function."""
+    return [x[0]*x[3] + x[3]*(x[0] + x[1] + x[2]),
+            x[0]*x[3],
+            x[0]*x[3] + 1.0,
+            x[0]*(x[0] + x[1] + x[2])]
+
+
+def grad_out(x, out):
+    """Gradient of objective function, written to `out`."""
+    x0_x3 = x[0]*x[3]
+    x0_x1_x2 = x[0] + x[1] + x[2]
+    out[0] = x0_x3 + x[3]*x0_x1_x2
+    out[1] = x0_x3
+    out[2] = x0_x3 + 1.0
+    out[3] = x[0]*x0_x1_x2
+
+
+def g(x):
+    """Constraint function."""
+    return [x[0]*x[1]*x[2]*x[3], 
+            x[0]*x[0] + x[1]*x[1] + x[2]*x[2] + x[3]*x[3]]
+
+
+def g_out(x, out):
+    """Constraint function, written to `out`."""
+    out[0] = x[0]*x[1]*x[2]*x[3]
+    out[1] = x[0]*x[0] + x[1]*x[1] + x[2]*x[2] + x[3]*x[3]
+
+
+def jac_ind():
+    """Indices of constraint Jacobian elements."""
+    return ([0, 0, 0, 0, 1, 1, 1, 1],
+            [0, 1, 2, 3, 0, 1, 2, 3])
+
+
+def jac_val(x):
+    """Values of nonzero constraint Jacobian elements."""
+    return [x[1]*x[2]*x[3], 
+            x[0]*x[2]*x[3], 
+            x[0]*x[1]*x[3], 
+            x[0]*x[1]*x[2],
+            2.0*x[0],
+            2.0*x[1],
+            2.0*x[2],
+            2.0*x[3]]
+
+
+def jac_val_out(x, out):
+    """Values of nonzero constraint Jacobian elements, written to `out`."""
+    out[0] = x[1]*x[2]*x[3]
+    out[1] = x[0]*x[2]*x[3]
+    out[2] = x[0]*x[1]*x[3]
+    out[3] = x[0]*x[1]*x[2]
+    np.multiply(x, 2.0, out[4:])
+
+
+def hess_ind():
+    """Indices of Lagrangian Hessian elements."""
+    return ([0, 1, 1, 2, 2, 2, 3, 3, 3, 3],
+            [0, 0, 1, 0, 1, 2, 0, 1, 2, 3])
+
+
+def hess_val(x, obj_factor, mult):
+    """Values of nonzero Lagrangian Hessian  elements."""
+    return [obj_factor*2*x[3] + mult[1]*2,
+            obj_factor*x[3] + mult[0]*(x[2]*x[3]),
+            mult[1]*2,
+            obj_factor*(x[3]) + mult[0]*(x[1]*x[3]),
+            mult[0]*(x[0]*x[3]),
+            mult[1]*2,
+            obj_factor*(2*x[0] + x[1] + x[2]) +  mult[0]*x[1]*x[2],
+            obj_factor*x[0] + mult[0]*x[0]*x[2],
+            obj_factor*x[0] + mult[0]*x[0]*x[1],
+            mult[1]*2]
+
+
+def hess_val_out(x, obj_factor, mult, out):
+    """Values of nonzero Lagrangian Hessian elements, written to `out`."""
+    mult1_2 = mult[1]*2
+    obj_x0 = obj_factor*x[0]
+    obj_x3 = obj_factor*x[3]
+    mult0_x3 = mult[0]*x[3]
+    out[0] = obj_x3*2 + mult1_2
+    out[1] = obj_x3 + mult0_x3*x[2]
+    out[2] = mult1_2
+    out[3] = obj_x3 + mult0_x3*x[1]
+    out[4] = mult0_x3*x[0]
+    out[5] = mult1_2
+    out[6] = obj_factor*(2*x[0] + x[1] + x[2]) + mult[0]*x[1]*x[2]
+    out[7] = obj_x0 + mult[0]*x[0]*x[2]
+    out[8] = obj_x0 + mult[0]*x[0]*x[1]
+    out[9] = mult1_2
+
+
+x_b = ([1.0] * 4, [5.0] * 4)
+g_b = ([25, 40], [2e19, 40])
+expected_xopt = np.r_[1, 4.743, 3.82115, 1.379408]
+
+
+output_protocols = pytest.mark.parametrize(
+    'g, grad, jac_val, hess_val',
+    [(g, grad, jac_val, hess_val),
+     (g_out, grad_out, jac_val_out, hess_val_out)],
+    ids=['return', 'out']
+)
+"""Run a test with the functions returning their values or writing them."""
+
+
+@output_protocols
+def test_hs071(g, grad, jac_val, hess_val):
+    jac = jac_ind, jac_val
+    h = hess_ind, hess_val
+    with ez.Problem(x_b, g_b, f, g, grad, jac, 8, h, 10) as problem:
+        x0 = [1, 5, 5, 1]
+        xopt, info = problem.solve(x0)
     
-    def grad(x):
-        """Gradient of objective function."""
-        return [x[0]*x[3] + x[3]*(x[0] + x[1] + x[2]),
-                x[0]*x[3],
-                x[0]*x[3] + 1.0,
-                x[0]*(x[0] + x[1] + x[2])]
+    err = xopt - expected_xopt
+    np.testing.assert_almost_equal(xopt, expected_xopt, decimal=6)
+
+
+def test_hs071_no_copy():
+    jac = jac_ind, jac_val
+    h = hess_ind, hess_val
+    with ez.Problem(x_b, g_b, f, g, grad, jac, 8, h, 10) as problem:
+        problem.add_int_option('print_level', 0)
+        x0 = np.array([1.0, 5, 5, 1])
+        xopt, info = problem.solve(x0, copy=False)
+        xopt_list, info = problem.solve([1, 5, 5, 1], copy=False)
     
-    def g(x):
-        """Constraint function."""
-        return [x[0]*x[1]*x[2]*x[3], 
-                x[0]*x[0] + x[1]*x[1] + x[2]*x[2] + x[3]*x[3]]
-
-    def jac_ind():
-        """Indices of constraint Jacobian elements."""
-        return ([0, 0, 0, 0, 1, 1, 1, 1],
-                [0, 1, 2, 3, 0, 1, 2, 3])
-
-
-    def jac_val(x):
-        """Values of nonzero constraint Jacobian elements."""
-        return [x[1]*x[2]*x[3], 
-                x[0]*x[2]*x[3], 
-                x[0]*x[1]*x[3], 
-                x[0]*x[1]*x[2],
-                2.0*x[0],
-                2.0*x[1],
-                2.0*x[2],
-                2.0*x[3]]
+    assert xopt is x0
+    np.testing.assert_almost_equal(xopt, expected_xopt, decimal=6)
+    np.testing.assert_almost_equal(xopt_list, expected_xopt, decimal=6)
+
+
+def test_hs071_fg():
+    evaluations = []
+    def fg(x):
+        """Objective function and its gradient."""
+        evaluations.append(x.copy())
+        return f(x), grad(x)
     
-    def hess_ind():
-        """Indices of Lagrangian Hessian elements."""
-        return ([0, 1, 1, 2, 2, 2, 3, 3, 3, 3],
-                [0, 0, 1, 0, 1, 2, 0, 1, 2, 3])
-
-    def hess_val(x, obj_factor, mult):
-        """Values of nonzero Lagrangian Hessian  elements."""
-        return [obj_factor*2*x[3] + mult[1]*2,
-                obj_factor*x[3] + mult[0]*(x[2]*x[3]),
-                mult[1]*2,
-                obj_factor*(x[3]) + mult[0]*(x[1]*x[3]),
-                mult[0]*(x[0]*x[3]),
-                mult[1]*2,
-                obj_factor*(2*x[0] + x[1] + x[2]) +  mult[0]*x[1]*x[2],
-                obj_factor*x[0] + mult[0]*x[0]*x[2],
-                obj_factor*x[0] + mult[0]*x[0]*x[1],
-                mult[1]*2]
-
-    x_b = ([1.0] * 4, [5.0] * 4)
-    g_b = ([25, 40], [2e19, 40])
     jac = jac_ind, jac_val
     h = hess_ind, hess_val
-    with ez.Problem(x_b, g_b, f, g, grad, jac, 8, h, 10) as problem:
+    with ez.Problem(x_b, g_b, None, g, None, jac, 8, h, 10, fg=fg) as problem:
+        x0 = [1, 5, 5, 1]
+        xopt, info = problem.solve(x0)
+    
+    np.testing.assert_almost_equal(xopt, expected_xopt, decimal=6)
+    
+    # Objective and gradient at the same point are evaluated only once
+    for x, x_next in zip(evaluations, evaluations[1:]):
+        assert not np.array_equal(x, x_next)
+
+
+@output_protocols
+def test_hs071_njit(g, grad, jac_val, hess_val):
+    pytest.importorskip('numba')
+    jac = jac_ind, jac_val
+    h = hess_ind, hess_val
+    with ez.njit_problem(x_b, g_b, f, g, grad, jac, hess=h) as problem:
         x0 = [1, 5, 5, 1]
         xopt, info = problem.solve(x0)
     
-    expected_xopt = np.r_[1, 4.743, 3.82115, 1.379408]
-    err = xopt - expected_xopt
     np.testing.assert_almost_equal(xopt, expected_xopt, decimal=6)
+
+
+def test_unconstrained():
+    def f(x):
+        return np.sum((x - 1) ** 2)
+    
+    def grad(x, out):
+        np.multiply(x - 1, 2, out)
+    
+    def g(x):
+        raise AssertionError('empty constraint function evaluated')
+    
+    jac = ([], []), g
+    hess = ([0, 1], [0, 1]), lambda x, obj_factor, mult: [2*obj_factor] * 2
+    with ez.Problem(([-5] * 2, [5] * 2), ([], []), f, g, grad, jac,
+                    hess=hess) as problem:
+        problem.add_int_option('print_level', 0)
+        xopt, info = problem.solve([3, -3])
+    
+    assert info['status'] == 0
+    np.testing.assert_almost_equal(xopt, [1, 1])
+
+
+def test_fg_parameter_change():
+    target = 1.0
+    evaluations = []
+    def fg(x):
+        evaluations.append(x.copy())
+        return np.sum((x - target) ** 2), 2 * (x - target)
+    
+    jac = ([], []), None
+    hess = ([0], [0]), lambda x, obj_factor, mult: [2*obj_factor]
+    with ez.Problem(([-5], [5]), ([], []), None, None, None, jac,
+                    hess=hess, fg=fg) as problem:
+        problem.add_int_option('print_level', 0)
+        x1, info = problem.solve([0])
+        np.testing.assert_almost_equal(x1, [1])
+        
+        # Warm start from the previous solution, where `fg` was cached
+        target = 3.0
+        first_evaluation = len(evaluations)
+        x2, info = problem.solve(x1)
+    
+    # The new solve evaluates `fg` at its starting point again
+    np.testing.assert_equal(evaluations[first_evaluation], x1)
+    assert info['status'] == 0
+    np.testing.assert_almost_equal(x2, [3])
+
+
+def test_warm_start_option(monkeypatch):
+    sent = []
+    def add_str_option(self, keyword, val):
+        if keyword == 'warm_start_init_point':
+            sent.append(val)
+        return add_str_option_orig(self, keyword, val)
+    
+    add_str_option_orig = ez.bare_np.Problem.add_str_option
+    monkeypatch.setattr(ez.bare_np.Problem, 'add_str_option', add_str_option)
+    
+    jac = jac_ind, jac_val
+    h = hess_ind, hess_val
+    with ez.Problem(x_b, g_b, f, g, grad, jac, hess=h) as problem:
+        problem.add_int_option('print_level', 0)
+        x, info = problem.solve([1, 5, 5, 1])
+        assert sent == ['no']
+        
+        # The option is only sent again when the kind of start changes
+        x, info = problem.solve(x)
+        assert sent == ['no']
+        mult = {k: info[k].copy() for k in ('mult_g', 'mult_x_L', 'mult_x_U')}
+        x, info = problem.solve(x, **mult)
+        x, info = problem.solve(x, **mult)
+        assert sent == ['no', 'yes']
+        
+        # or when it might have been changed by the user
+        problem.add_str_option('warm_start_init_point', 'no')
+        x, info = problem.solve(x, **mult)
+        assert sent == ['no', 'yes', 'no', 'yes']
+    
+    assert info['status'] == 0
+    np.testing.assert_almost_equal(x, expected_xopt, decimal=6)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import setuptools
+from setuptools.command.build_ext import build_ext
+from setuptools.errors import CCompilerError, ExecError, PlatformError
 
 with open("README.md", encoding="utf-8") as f:
     long_description = f.read()
@@ -20,6 +22,41 @@ Programming Language :: Python :: 3
 Topic :: Scientific/Engineering
 Topic :: Software Development"""
 
+# The compiled callbacks are optional, build them only if Cython is available
+try:
+    import numpy
+    from Cython.Build import cythonize
+except ImportError:
+    ext_modules = []
+else:
+    ext_modules = cythonize([
+        setuptools.Extension("mseipopt._callbacks",
+                             ["mseipopt/_callbacks.pyx"],
+                             include_dirs=[numpy.get_include()])
+    ])
+
+
+class optional_build_ext(build_ext):
+    """Build the extensions, skipping them if they cannot be compiled."""
+
+    build_errors = CCompilerError, ExecError, PlatformError
+
+    def run(self):
+        try:
+            super().run()
+        except self.build_errors as e:
+            self.warn(f"skipping the compiled callbacks: {e}")
+
+    def build_extensions(self):
+        self.check_extensions_list(self.extensions)
+        for ext in list(self.extensions):
+            try:
+                self.build_extension(ext)
+            except self.build_errors as e:
+                self.warn(f"skipping the compiled callbacks {ext.name}: {e}")
+                self.extensions.remove(ext)  # Not copied or installed
+
+
 setuptools.setup(
     name="mseipopt",
     version="0.1.dev2",
@@ -30,6 +67,8 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="http://github.com/cea-ufmg/mseipopt",
     packages=setuptools.find_packages(),
+    ext_modules=ext_modules,
+    cmdclass={"build_ext": optional_build_ext},
     classifiers=CLASSIFIERS.split('\n'),
     platforms=["Windows", "Linux", "Solaris", "Mac OS-X", "Unix"],
     license="MIT",